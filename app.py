@@ -5,11 +5,13 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from authlib.integrations.flask_client import OAuth
 import os
+import click
 import requests
 from datetime import datetime, timedelta
 
 from models import db, User, Product, BlogPost, Project, Order, OrderItem, MaintenanceBooking
 from forms import LoginForm, ProductForm # You'll need to update forms.py too
+import migrations
 
 app = Flask(__name__, 
             static_url_path='/static', 
@@ -92,25 +94,25 @@ def calculators():
 def products():
     category = request.args.get('category')
     if category:
-        products = Product.query.filter_by(category=category).order_by(Product.created_at.desc()).all()
+        products = Product.newest_first(category=category).all()
     else:
-        products = Product.query.order_by(Product.created_at.desc()).all()
+        products = Product.newest_first().all()
     return render_template('products.html', products=products, category=category)
 
 @app.route('/offers')
 def offers():
-    products = Product.query.filter_by(is_special_offer=True).order_by(Product.created_at.desc()).all()
+    products = Product.newest_first(is_special_offer=True).all()
     return render_template('offers.html', products=products)
 
 @app.route('/projects')
 def projects():
     # Dynamic projects
-    projects = Project.query.order_by(Project.created_at.desc()).all()
+    projects = Project.newest_first().all()
     return render_template('projects.html', projects=projects)
 
 @app.route('/blog')
 def blog():
-    posts = BlogPost.query.order_by(BlogPost.created_at.desc()).all()
+    posts = BlogPost.newest_first().all()
     return render_template('blog.html', posts=posts)
 
 # --- E-commerce Routes ---
@@ -329,7 +331,7 @@ def logout():
 @app.route('/dashboard')
 @staff_required
 def dashboard():
-    products = Product.query.order_by(Product.created_at.desc()).all()
+    products = Product.newest_first().all()
     return render_template('dashboard.html', products=products)
 
 @app.route('/dashboard/add', methods=['GET', 'POST'])
@@ -444,7 +446,7 @@ def reset_staff_password(user_id):
 @app.route('/dashboard/blog')
 @staff_required
 def manage_blog():
-    posts = BlogPost.query.order_by(BlogPost.created_at.desc()).all()
+    posts = BlogPost.newest_first().all()
     return render_template('manage_blog.html', posts=posts)
 
 @app.route('/dashboard/blog/add', methods=['GET', 'POST'])
@@ -474,9 +476,15 @@ def delete_blog_post(post_id):
     return redirect(url_for('manage_blog'))
 
 # Application Context Commands
+def upgrade_db(target=None):
+    try:
+        return migrations.upgrade(target=target)
+    except migrations.MigrationError as e:
+        raise click.ClickException(str(e))
+
 @app.cli.command("create_admin")
 def create_admin():
-    db.create_all()
+    upgrade_db()
     if not User.query.filter_by(username='admin').first():
         hashed_pw = generate_password_hash('admin123', method='pbkdf2:sha256')
         admin = User(username='admin', password_hash=hashed_pw, role='admin')
@@ -491,7 +499,7 @@ def reset_db():
     """Drops all tables and recreates them."""
     if input("Are you sure you want to drop all tables? (y/n): ").lower() == 'y':
         db.drop_all()
-        db.create_all()
+        upgrade_db()
         
         # Create admin
         hashed_pw = generate_password_hash('admin123', method='pbkdf2:sha256')
@@ -502,12 +510,49 @@ def reset_db():
     else:
         print("Operation cancelled.")
 
+@app.cli.command("db_upgrade")
+@click.option('--target', type=int, help='Stop after this migration version.')
+def db_upgrade(target):
+    """Applies pending schema migrations."""
+    applied = upgrade_db(target)
+    for m in applied:
+        print(f"Applied {m['version']}: {m['description']}")
+    if not applied:
+        print("Database is up to date.")
+
+@app.cli.command("db_status")
+def db_status():
+    """Lists applied and pending schema migrations."""
+    applied = migrations.applied_versions()
+    for m in migrations.MIGRATIONS:
+        state = 'applied' if m['version'] in applied else 'pending'
+        print(f"{m['version']:>4}  {state:<8} {m['description']}")
+
+@app.cli.command("explain")
+@click.option('--disable-seqscan', is_flag=True, help='Postgres only: make the planner prefer indexes on small tables.')
+@click.option('--strict', is_flag=True, help='Exit with an error if a filtered query reads a whole table.')
+def explain(disable_seqscan, strict):
+    """Runs EXPLAIN for the hot queries and reports full table scans."""
+    results = migrations.explain(disable_seqscan=disable_seqscan)
+    unexpected = 0
+    for name, plan, scans, full_scan_expected in results:
+        label = ''
+        if scans:
+            label = f"  [FULL SCAN{' (expected)' if full_scan_expected else ''}: {', '.join(scans)}]"
+            unexpected += not full_scan_expected
+        print(f"== {name}{label}")
+        for line in plan:
+            print(f"   {line}")
+    print(f"{unexpected} of {len(results)} queries read a whole table unexpectedly.")
+    if strict and unexpected:
+        raise SystemExit(1)
+
 # --- Order & Maintenance Management (Admin/Staff) ---
 
 @app.route('/dashboard/orders')
 @staff_required
 def manage_orders():
-    orders = Order.query.order_by(Order.created_at.desc()).all()
+    orders = Order.newest_first().all()
     return render_template('manage_orders.html', orders=orders)
 
 @app.route('/dashboard/orders/update/<int:order_id>', methods=['POST'])
@@ -524,7 +569,7 @@ def update_order_status(order_id):
 @app.route('/dashboard/maintenance')
 @staff_required
 def manage_maintenance():
-    bookings = MaintenanceBooking.query.order_by(MaintenanceBooking.created_at.desc()).all()
+    bookings = MaintenanceBooking.newest_first().all()
     return render_template('manage_maintenance.html', bookings=bookings)
 
 @app.route('/dashboard/maintenance/delete/<int:booking_id>')
@@ -538,7 +583,11 @@ def delete_maintenance_booking(booking_id):
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        try:
+            upgrade_db()
+        except click.ClickException as e:
+            e.show()
+            raise SystemExit(e.exit_code)
         # Auto-create admin user
         if not User.query.filter_by(username='admin').first():
             hashed_pw = generate_password_hash('admin123', method='pbkdf2:sha256')
@@ -0,0 +1,304 @@
+"""Versioned schema migrations and query plan checks.
+
+Migrations run in version order and each applied version is recorded in the
+``schema_migration`` table, so ``upgrade()`` is safe to run on every deploy.
+Index migrations use ``CREATE INDEX CONCURRENTLY`` on Postgres so that
+production tables stay writable while the index builds.
+"""
+import re
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, String, Text, Float, Boolean, Date, DateTime,
+    ForeignKey, inspect, text,
+)
+
+from models import db, Product, Project, BlogPost, Order, MaintenanceBooking, SchemaMigration
+
+MIGRATIONS = []
+
+# Key for pg_advisory_lock, shared by every host running migrations.
+LOCK_ID = 7310915
+LOCK_POLL_SECONDS = 1
+
+
+class MigrationError(Exception):
+    pass
+
+
+def migration(version, description, transactional=True):
+    """Register a migration. Non-transactional ones run in autocommit mode."""
+    def register(func):
+        MIGRATIONS.append({
+            'version': version,
+            'description': description,
+            'transactional': transactional,
+            'apply': func,
+        })
+        MIGRATIONS.sort(key=lambda m: m['version'])
+        return func
+    return register
+
+
+def _create_index(conn, name, table, columns, where=None):
+    preparer = conn.dialect.identifier_preparer
+    if conn.dialect.name == 'postgresql':
+        # A failed concurrent build leaves an INVALID index behind, which
+        # IF NOT EXISTS would silently keep. Drop it so the build is retried.
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ), {'name': name}).first()
+        if invalid:
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {preparer.quote(name)}'))
+        concurrently = 'CONCURRENTLY '
+    else:
+        concurrently = ''
+    sql = (
+        f'CREATE INDEX {concurrently}IF NOT EXISTS {preparer.quote(name)} '
+        f'ON {preparer.quote(table)} ({", ".join(preparer.quote(c) for c in columns)})'
+    )
+    if where:
+        sql += f' WHERE {where}'
+    conn.execute(text(sql))
+
+
+# Schema as of migration 1. Frozen here rather than read from models.py, so
+# later migrations can change the models without changing what 1 creates.
+BASE_SCHEMA = MetaData()
+
+Table('user', BASE_SCHEMA,
+      Column('id', Integer, primary_key=True),
+      Column('username', String(150), unique=True),
+      Column('email', String(150), unique=True),
+      Column('password_hash', String(200)),
+      Column('role', String(50), nullable=False),
+      Column('google_id', String(200), unique=True),
+      Column('created_at', DateTime))
+
+Table('product', BASE_SCHEMA,
+      Column('id', Integer, primary_key=True),
+      Column('name', String(150), nullable=False),
+      Column('description', Text),
+      Column('category', String(50), nullable=False),
+      Column('image_filename', String(255)),
+      Column('price', Float, nullable=False),
+      Column('stock', Integer, nullable=False),
+      Column('is_special_offer', Boolean),
+      Column('created_at', DateTime))
+
+Table('blog_post', BASE_SCHEMA,
+      Column('id', Integer, primary_key=True),
+      Column('title', String(200), nullable=False),
+      Column('content', Text, nullable=False),
+      Column('image_filename', String(255)),
+      Column('author_id', Integer, ForeignKey('user.id'), nullable=False),
+      Column('created_at', DateTime))
+
+Table('project', BASE_SCHEMA,
+      Column('id', Integer, primary_key=True),
+      Column('title', String(200), nullable=False),
+      Column('description', Text),
+      Column('image_filename', String(255), nullable=False),
+      Column('created_at', DateTime))
+
+Table('order', BASE_SCHEMA,
+      Column('id', Integer, primary_key=True),
+      Column('user_id', Integer, ForeignKey('user.id')),
+      Column('customer_name', String(150), nullable=False),
+      Column('phone_number', String(20), nullable=False),
+      Column('address', Text, nullable=False),
+      Column('delivery_date', Date, nullable=False),
+      Column('delivery_cost', Float, nullable=False),
+      Column('total_price', Float, nullable=False),
+      Column('status', String(50)),
+      Column('created_at', DateTime))
+
+Table('order_item', BASE_SCHEMA,
+      Column('id', Integer, primary_key=True),
+      Column('order_id', Integer, ForeignKey('order.id'), nullable=False),
+      Column('product_id', Integer, ForeignKey('product.id'), nullable=False),
+      Column('quantity', Integer, nullable=False),
+      Column('price_at_purchase', Float, nullable=False))
+
+Table('maintenance_booking', BASE_SCHEMA,
+      Column('id', Integer, primary_key=True),
+      Column('customer_name', String(150), nullable=False),
+      Column('phone_number', String(20), nullable=False),
+      Column('service_type', String(100), nullable=False),
+      Column('location_latitude', Float),
+      Column('location_longitude', Float),
+      Column('status', String(50)),
+      Column('created_at', DateTime))
+
+
+@migration(1, 'Create base tables')
+def create_base_tables(conn):
+    # Databases created by db.create_all() before migrations existed are
+    # adopted as-is, but only if their tables match the baseline exactly.
+    inspector = inspect(conn)
+    problems = []
+    for table in BASE_SCHEMA.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        expected = {c.name for c in table.columns}
+        found = {c['name'] for c in inspector.get_columns(table.name)}
+        if expected - found:
+            problems.append(f"{table.name} is missing {', '.join(sorted(expected - found))}")
+        if found - expected:
+            problems.append(f"{table.name} has unexpected {', '.join(sorted(found - expected))}")
+    if problems:
+        raise MigrationError(
+            'Existing tables do not match the baseline schema: ' + '; '.join(problems) + '. '
+            'Back up any data you need, then run `flask reset_db` to recreate the database.'
+        )
+    BASE_SCHEMA.create_all(bind=conn)
+
+
+@migration(2, 'Index listing columns', transactional=False)
+def add_listing_indexes(conn):
+    # Listings filter on the leading columns and sort on created_at, so one
+    # index serves both and no separate sort is needed. The status indexes
+    # are for staff filtering; no page filters on status yet.
+    for table, columns in [
+        ('product', ['created_at']),
+        ('product', ['category', 'created_at']),
+        ('project', ['created_at']),
+        ('blog_post', ['created_at']),
+        ('order', ['created_at']),
+        ('order', ['status']),
+        ('maintenance_booking', ['created_at']),
+        ('maintenance_booking', ['status']),
+    ]:
+        _create_index(conn, f"ix_{table}_{'_'.join(columns)}", table, columns)
+
+
+@migration(3, 'Index product special offers', transactional=False)
+def add_special_offer_index(conn):
+    # Offers are a small share of products: on Postgres a partial index
+    # holds just those rows. SQLite only uses a partial index when the
+    # query repeats its WHERE term, so it gets a plain composite one.
+    if conn.dialect.name == 'postgresql':
+        _create_index(conn, 'ix_product_special_offer', 'product', ['created_at'], where='is_special_offer')
+    else:
+        _create_index(conn, 'ix_product_special_offer', 'product', ['is_special_offer', 'created_at'])
+
+
+def applied_versions(engine=None):
+    """Return the applied versions. A database without the table has none."""
+    engine = engine or db.engine
+    table = SchemaMigration.__table__
+    with engine.connect() as conn:
+        if not inspect(conn).has_table(table.name):
+            return set()
+        return {row.version for row in conn.execute(table.select())}
+
+
+@contextmanager
+def _migration_lock(engine):
+    if engine.dialect.name != 'postgresql':
+        yield
+        return
+    # Session-level lock on an autocommit connection: an open transaction
+    # here would make CREATE INDEX CONCURRENTLY wait on it forever. For the
+    # same reason a waiting host polls instead of blocking in pg_advisory_lock,
+    # whose running statement would hold a snapshot the index build waits on.
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+        while not conn.execute(text('SELECT pg_try_advisory_lock(:id)'), {'id': LOCK_ID}).scalar():
+            time.sleep(LOCK_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            conn.execute(text('SELECT pg_advisory_unlock(:id)'), {'id': LOCK_ID})
+
+
+def upgrade(target=None, engine=None):
+    """Apply pending migrations up to ``target`` and return the ones applied."""
+    engine = engine or db.engine
+    applied = []
+    with _migration_lock(engine):
+        SchemaMigration.__table__.create(bind=engine, checkfirst=True)
+        for m in MIGRATIONS:
+            if target is not None and m['version'] > target:
+                break
+            # Re-read under the lock: another host may have just applied it.
+            if m['version'] in applied_versions(engine):
+                continue
+            if m['transactional']:
+                with engine.begin() as conn:
+                    m['apply'](conn)
+                    _record(conn, m)
+            else:
+                with engine.connect() as conn:
+                    conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+                    m['apply'](conn)
+                    _record(conn, m)
+            applied.append(m)
+    return applied
+
+
+def _record(conn, m):
+    conn.execute(SchemaMigration.__table__.insert().values(
+        version=m['version'], description=m['description']
+    ))
+
+
+# The listing queries behind the app's pages, with representative filter
+# values. Unfiltered listings show every row, so a full scan is expected.
+def hot_queries():
+    return [
+        ('products', Product.newest_first(), True),
+        ('products by category', Product.newest_first(category='solar'), False),
+        ('special offers', Product.newest_first(is_special_offer=True), False),
+        ('projects', Project.newest_first(), True),
+        ('blog', BlogPost.newest_first(), True),
+        ('orders', Order.newest_first(), True),
+        ('maintenance bookings', MaintenanceBooking.newest_first(), True),
+    ]
+
+
+def _seq_scans(dialect, plan):
+    """Return the tables a plan reads in full.
+
+    On SQLite every ``SCAN`` reads the whole table, even ``USING INDEX``
+    (which only avoids a sort); ``SEARCH`` is what narrows rows by index.
+    """
+    if dialect == 'postgresql':
+        pattern = re.compile(r'Seq Scan on (\S+)')
+    else:
+        pattern = re.compile(r'^SCAN (?:TABLE )?(\S+)')
+    scans = []
+    for line in plan:
+        match = pattern.search(line.strip())
+        if match:
+            scans.append(match.group(1).strip('"'))
+    return scans
+
+
+def explain(disable_seqscan=False, engine=None):
+    """EXPLAIN each hot query.
+
+    Returns (name, plan lines, fully scanned tables, full scan expected)
+    tuples. On Postgres, ``disable_seqscan`` makes the planner use any
+    usable index even on tiny dev tables, where a Seq Scan would otherwise
+    always win.
+    """
+    engine = engine or db.engine
+    dialect = engine.dialect.name
+    results = []
+    with engine.connect() as conn:
+        if dialect == 'postgresql' and disable_seqscan:
+            conn.execute(text('SET LOCAL enable_seqscan = off'))
+        for name, query, full_scan_expected in hot_queries():
+            sql = str(query.statement.compile(
+                dialect=engine.dialect, compile_kwargs={'literal_binds': True}
+            ))
+            if dialect == 'sqlite':
+                plan = [row[-1] for row in conn.execute(text('EXPLAIN QUERY PLAN ' + sql))]
+            else:
+                plan = [row[0] for row in conn.execute(text('EXPLAIN ' + sql))]
+            results.append((name, plan, _seq_scans(dialect, plan), full_scan_expected))
+        conn.rollback()
+    return results
@@ -6,6 +6,12 @@ db = SQLAlchemy()
 
 # Models
 
+class NewestFirstMixin:
+    # Listing query shared by the pages and `flask explain`.
+    @classmethod
+    def newest_first(cls, **filters):
+        return cls.query.filter_by(**filters).order_by(cls.created_at.desc())
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(150), unique=True, nullable=True) # Nullable for Google users
@@ -15,7 +21,7 @@ class User(UserMixin, db.Model):
     google_id = db.Column(db.String(200), unique=True, nullable=True) # Google ID
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-class Product(db.Model):
+class Product(NewestFirstMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(150), nullable=False)
     description = db.Column(db.Text, nullable=True)
@@ -26,7 +32,7 @@ class Product(db.Model):
     is_special_offer = db.Column(db.Boolean, default=False) # For special offers page
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-class BlogPost(db.Model):
+class BlogPost(NewestFirstMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=False)
@@ -36,14 +42,14 @@ class BlogPost(db.Model):
     
     author = db.relationship('User', backref='posts')
 
-class Project(db.Model):
+class Project(NewestFirstMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=True)
     image_filename = db.Column(db.String(255), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-class Order(db.Model):
+class Order(NewestFirstMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True) # Nullable for guest checkout if allowed
     customer_name = db.Column(db.String(150), nullable=False)
@@ -66,7 +72,7 @@ class OrderItem(db.Model):
 
     product = db.relationship('Product')
 
-class MaintenanceBooking(db.Model):
+class MaintenanceBooking(NewestFirstMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     customer_name = db.Column(db.String(150), nullable=False)
     phone_number = db.Column(db.String(20), nullable=False)
@@ -75,3 +81,8 @@ class MaintenanceBooking(db.Model):
     location_longitude = db.Column(db.Float, nullable=True)
     status = db.Column(db.String(50), default='Pending') # Pending, Scheduled, Completed
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SchemaMigration(db.Model):
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,293 @@
+import os
+import sqlite3
+import threading
+import uuid
+
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine, inspect, make_url, text
+from sqlalchemy.dialects import postgresql
+
+import migrations
+from models import db
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return create_engine(f'sqlite:///{tmp_path / "site.db"}')
+
+
+def make_app(uri):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    db.init_app(app)
+    return app
+
+
+@pytest.fixture
+def app(tmp_path):
+    with make_app(f'sqlite:///{tmp_path / "app.db"}').app_context():
+        yield
+
+
+@pytest.fixture(scope='session')
+def postgres_url(tmp_path_factory):
+    # Runs against TEST_POSTGRES_URL, or a throwaway server from pgserver.
+    url = os.environ.get('TEST_POSTGRES_URL')
+    if not url:
+        pgserver = pytest.importorskip('pgserver')
+        url = pgserver.get_server(str(tmp_path_factory.mktemp('pg'))).get_uri()
+    url = make_url(url)
+    # Use the driver from requirements.txt; bare postgresql:// may pick another.
+    return url.set(drivername='postgresql+psycopg2') if url.drivername == 'postgresql' else url
+
+
+@pytest.fixture
+def postgres_db(postgres_url):
+    name = f'test_{uuid.uuid4().hex[:12]}'
+    admin = create_engine(postgres_url, isolation_level='AUTOCOMMIT')
+    with admin.connect() as conn:
+        conn.execute(text(f'CREATE DATABASE {name}'))
+    yield postgres_url.set(database=name)
+    with admin.connect() as conn:
+        conn.execute(text(f'DROP DATABASE {name} WITH (FORCE)'))
+    admin.dispose()
+
+
+@pytest.fixture
+def postgres_engine(postgres_db):
+    engine = create_engine(postgres_db)
+    yield engine
+    engine.dispose()
+
+
+def index_names(engine, table):
+    return {ix['name'] for ix in inspect(engine).get_indexes(table)}
+
+
+def test_baseline_matches_models():
+    for table in migrations.BASE_SCHEMA.sorted_tables:
+        model_table = db.metadata.tables[table.name]
+        assert {c.name for c in table.columns} == {c.name for c in model_table.columns}
+
+
+def test_upgrade_fresh_database(engine):
+    applied = migrations.upgrade(engine=engine)
+
+    assert [m['version'] for m in applied] == [m['version'] for m in migrations.MIGRATIONS]
+    assert migrations.applied_versions(engine) == {m['version'] for m in migrations.MIGRATIONS}
+    assert {'ix_product_created_at', 'ix_product_category_created_at', 'ix_product_special_offer'} <= index_names(engine, 'product')
+    assert {'ix_order_status', 'ix_order_created_at'} <= index_names(engine, 'order')
+    assert 'ix_blog_post_created_at' in index_names(engine, 'blog_post')
+    assert migrations.upgrade(engine=engine) == []
+
+
+def test_upgrade_target(engine):
+    assert [m['version'] for m in migrations.upgrade(target=1, engine=engine)] == [1]
+    assert migrations.applied_versions(engine) == {1}
+    assert index_names(engine, 'product') == set()
+
+    assert [m['version'] for m in migrations.upgrade(engine=engine)] == [2, 3]
+
+
+def test_upgrade_adopts_matching_database(engine):
+    migrations.BASE_SCHEMA.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(migrations.BASE_SCHEMA.tables['product'].insert().values(
+            name='Panel', category='solar', price=100.0, stock=1
+        ))
+
+    migrations.upgrade(engine=engine)
+
+    with engine.connect() as conn:
+        assert conn.execute(migrations.BASE_SCHEMA.tables['product'].select()).first().name == 'Panel'
+    assert 'ix_product_category_created_at' in index_names(engine, 'product')
+
+
+def test_upgrade_refuses_mismatched_database(engine, tmp_path):
+    # Same shape as the old instance/site.db product table.
+    conn = sqlite3.connect(tmp_path / 'site.db')
+    conn.execute(
+        'CREATE TABLE product (id INTEGER PRIMARY KEY, name VARCHAR(150) NOT NULL, '
+        'description TEXT, category VARCHAR(50) NOT NULL, image_filename VARCHAR(255), '
+        'created_at DATETIME)'
+    )
+    conn.close()
+
+    with pytest.raises(migrations.MigrationError, match='product is missing is_special_offer, price, stock.*flask reset_db'):
+        migrations.upgrade(engine=engine)
+    assert migrations.applied_versions(engine) == set()
+
+
+def test_applied_versions_does_not_create_table(engine):
+    assert migrations.applied_versions(engine) == set()
+    assert not inspect(engine).has_table('schema_migration')
+
+
+def test_seq_scans_postgres():
+    plan = [
+        'Sort  (cost=10.00..10.50 rows=200 width=8)',
+        '  ->  Seq Scan on product  (cost=0.00..4.00 rows=200 width=8)',
+        '  ->  Parallel Seq Scan on "order"  (cost=0.00..9.00 rows=90 width=8)',
+        '  ->  Index Scan using ix_order_status on "order"  (cost=0.29..8.30 rows=1 width=8)',
+    ]
+    assert migrations._seq_scans('postgresql', plan) == ['product', 'order']
+
+
+def test_seq_scans_sqlite():
+    plan = [
+        'SCAN product',
+        'SCAN TABLE order_item',
+        'SCAN maintenance_booking USING INDEX ix_maintenance_booking_created_at',
+        'SEARCH order USING INDEX ix_order_status (status=?)',
+        'USE TEMP B-TREE FOR ORDER BY',
+    ]
+    assert migrations._seq_scans('sqlite', plan) == ['product', 'order_item', 'maintenance_booking']
+
+
+class RecordingConnection:
+    dialect = postgresql.dialect()
+
+    def __init__(self, invalid=False):
+        self.invalid = invalid
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        self.statements.append(str(statement))
+        return self
+
+    def first(self):
+        return (1,) if self.invalid else None
+
+
+def test_create_index_postgres():
+    conn = RecordingConnection()
+    migrations._create_index(conn, 'ix_product_special_offer', 'product', ['created_at'], where='is_special_offer')
+
+    assert 'pg_index' in conn.statements[0]
+    assert conn.statements[1:] == [
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_product_special_offer ON product (created_at) WHERE is_special_offer'
+    ]
+
+
+def test_create_index_postgres_drops_invalid_index():
+    conn = RecordingConnection(invalid=True)
+    migrations._create_index(conn, 'ix_order_status', 'order', ['status'])
+
+    assert conn.statements[1:] == [
+        'DROP INDEX CONCURRENTLY IF EXISTS ix_order_status',
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_order_status ON "order" (status)',
+    ]
+
+
+class RecordingEngine:
+    dialect = postgresql.dialect()
+
+    def __init__(self):
+        self.conn = RecordingConnection()
+
+    def connect(self):
+        return self
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, *exc):
+        return False
+
+
+def test_migration_lock_postgres():
+    engine = RecordingEngine()
+    engine.conn.execution_options = lambda **kw: engine.conn
+    engine.conn.scalar = lambda: True
+    with migrations._migration_lock(engine):
+        assert engine.conn.statements == ['SELECT pg_try_advisory_lock(:id)']
+    assert engine.conn.statements[-1] == 'SELECT pg_advisory_unlock(:id)'
+
+
+def test_explain_sqlite(app):
+    migrations.upgrade()
+    results = {name: (plan, scans, expected) for name, plan, scans, expected in migrations.explain()}
+
+    assert len(results) == len(migrations.hot_queries())
+    for name, (plan, scans, expected) in results.items():
+        assert expected or not scans, name
+        assert not any('TEMP B-TREE' in line for line in plan), name
+
+
+def test_upgrade_postgres(postgres_engine):
+    applied = migrations.upgrade(engine=postgres_engine)
+
+    assert [m['version'] for m in applied] == [m['version'] for m in migrations.MIGRATIONS]
+    assert migrations.upgrade(engine=postgres_engine) == []
+    with postgres_engine.connect() as conn:
+        assert conn.execute(text('SELECT count(*) FROM pg_index WHERE NOT indisvalid')).scalar() == 0
+        indexdef = conn.execute(text(
+            "SELECT indexdef FROM pg_indexes WHERE indexname = 'ix_product_special_offer'"
+        )).scalar()
+    assert indexdef.endswith('(created_at) WHERE is_special_offer')
+
+
+def test_upgrade_postgres_rebuilds_invalid_index(postgres_engine):
+    migrations.upgrade(target=1, engine=postgres_engine)
+    with postgres_engine.begin() as conn:
+        conn.execute(text('CREATE INDEX ix_order_status ON "order" (status)'))
+        conn.execute(text(
+            "UPDATE pg_index SET indisvalid = false "
+            "WHERE indexrelid = 'ix_order_status'::regclass"
+        ))
+
+    migrations.upgrade(engine=postgres_engine)
+
+    with postgres_engine.connect() as conn:
+        assert conn.execute(text('SELECT count(*) FROM pg_index WHERE NOT indisvalid')).scalar() == 0
+
+
+def test_migration_lock_postgres_is_idle(postgres_engine):
+    with migrations._migration_lock(postgres_engine):
+        with postgres_engine.connect() as conn:
+            state = conn.execute(text(
+                "SELECT state FROM pg_stat_activity WHERE query LIKE 'SELECT pg_try_advisory_lock%'"
+            )).scalar()
+            held = conn.execute(text(
+                "SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND objid = :id AND granted"
+            ), {'id': migrations.LOCK_ID}).scalar()
+    assert state == 'idle'
+    assert held == 1
+
+
+def test_concurrent_upgrade_postgres(postgres_engine):
+    results, errors = [], []
+    start = threading.Barrier(2)
+
+    def run():
+        start.wait()
+        try:
+            results.extend(m['version'] for m in migrations.upgrade(engine=postgres_engine))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert sorted(results) == [m['version'] for m in migrations.MIGRATIONS]
+
+
+def test_explain_postgres(postgres_db):
+    with make_app(postgres_db.render_as_string(hide_password=False)).app_context():
+        migrations.upgrade()
+        results = {name: (plan, scans, expected) for name, plan, scans, expected in migrations.explain(disable_seqscan=True)}
+        query_count = len(migrations.hot_queries())
+        db.engine.dispose()
+
+    assert len(results) == query_count
+    for name, (plan, scans, expected) in results.items():
+        assert not scans, name
+    category_plan = results['products by category'][0]
+    assert 'ix_product_category_created_at' in category_plan[0]
+    assert not any('Sort' in line for line in category_plan)
+    assert any('ix_product_special_offer' in line for line in results['special offers'][0])